@@ -1,42 +1,118 @@
 from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
 from langchain.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import JsonOutputParser
 from langchain_core.runnables import RunnablePassthrough
-from typing import List, Dict, Any
+from langchain.schema import Document
+from typing import List, Dict, Optional, Tuple, Any, AsyncIterator
+from collections import OrderedDict
+import functools
+import hashlib
+from functools import cached_property
+import asyncio
+import io
 import os
+import threading
 from dotenv import load_dotenv
-from document_processor import DocumentProcessor
+from document_processor import DocumentProcessor, DocumentType
 from retriever import RetrievalSystem
+from embeddings import CachedEmbeddings
+from semantic_cache import SemanticLLMCache
+from output_parsers import OrjsonOutputParser
+from utils.text_preprocessing import simhash64
 from utils.logging import setup_logging
 
 logger = setup_logging()
 
+# Recurring analyst queries whose embeddings are computed at startup
+DEFAULT_WARMUP_QUERIES = [
+    "Analyze the claim risk considering policy terms and claim history",
+    "Analyze the claim risk considering policy terms and claim report containing the estimated bill of repairs",
+    "Assess the fraud risk of this claim",
+    "Check the claim for policy compliance"
+]
+
+# Number of per-file retrievers kept for reuse across requests
+RETRIEVER_CACHE_SIZE = 32
+
+# Claims analysed concurrently by process_claims_batch
+BATCH_CONCURRENCY = 32
+
+# Prompt budget per document type, estimated at ~4 characters per token
+MAX_CONTEXT_TOKENS = 32000
+# Retrieved chunks whose SimHash fingerprints differ in fewer bits are treated as duplicates
+NEAR_DUPLICATE_BITS = 4
+
+_event_loop: Optional[asyncio.AbstractEventLoop] = None
+_event_loop_lock = threading.Lock()
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """Return the process-wide event loop, running in a daemon thread, that all async work uses"""
+    # The shared Gemini client binds its async channel to the first loop that uses it, so
+    # every coroutine touching it must run on one loop that lives as long as the process
+    global _event_loop
+    with _event_loop_lock:
+        if _event_loop is None:
+            _event_loop = asyncio.new_event_loop()
+            threading.Thread(target=_event_loop.run_forever, name="claim-risk-loop", daemon=True).start()
+        return _event_loop
+
+@functools.cache
+def get_api_key() -> Optional[str]:
+    """Load .env once per process and return the Google API key"""
+    load_dotenv()
+    return os.getenv("GOOGLE_API_KEY")
+
+@functools.cache
+def get_llm(model_name: str, api_key: Optional[str]) -> ChatGoogleGenerativeAI:
+    """Return a process-wide chat client so predictors share one connection pool"""
+    return ChatGoogleGenerativeAI(
+        google_api_key=api_key,
+        model=model_name,
+        temperature=0,
+        max_tokens=None,
+        timeout=None,
+        max_retries=2,
+    )
+
+@functools.cache
+def get_embedding_model(api_key: Optional[str]) -> CachedEmbeddings:
+    """Return a process-wide embedding client whose query cache is shared by all predictors"""
+    return CachedEmbeddings(GoogleGenerativeAIEmbeddings(
+        google_api_key=api_key,
+        model="models/embedding-001"
+    ))
+
 class ClaimRiskPredictor:
-    def __init__(self, model_name: str = "gemini-1.5-pro"):
-        load_dotenv()
-        self.google_api_key = os.getenv("GOOGLE_API_KEY")
+    def __init__(self, model_name: str = "gemini-1.5-pro", warmup_queries: Optional[List[str]] = None):
+        self.google_api_key = get_api_key()
         self.model_name = model_name
-        self.setup_components()
+        self.warmup_queries: List[str] = DEFAULT_WARMUP_QUERIES if warmup_queries is None else warmup_queries
+        # Built retrievers and their index keys, keyed by (role, file name and content digest), evicted least recently used first
+        self._retriever_cache: "OrderedDict[Tuple, Tuple[Any, Any, str]]" = OrderedDict()
+        self._retriever_cache_lock = threading.Lock()
 
-    def setup_components(self):
-        """Initialize components with document type-specific processing"""
+    @cached_property
+    def llm(self) -> ChatGoogleGenerativeAI:
+        """Chat model used for the risk analysis, built on first use"""
+        return get_llm(self.model_name, self.google_api_key)
+
+    @cached_property
+    def embedding_model(self) -> CachedEmbeddings:
+        """Embedding model shared by retrieval and the LLM cache"""
+        return get_embedding_model(self.google_api_key)
+
+    def warmup(self):
+        """Pre-embed the warmup queries; long-running services call this before taking requests"""
+        # A failed warmup only costs the cache hits, so it must not prevent use
         try:
-            self.llm = ChatGoogleGenerativeAI(
-                google_api_key=self.google_api_key,
-                model=self.model_name,
-                temperature=0,
-                max_tokens=None,
-                timeout=None,
-                max_retries=2,
-            )
-            
-            self.embedding_model = GoogleGenerativeAIEmbeddings(
-                google_api_key=self.google_api_key,
-                model="models/embedding-001"
-            )
-            
-            self.risk_prompt = ChatPromptTemplate.from_messages([
-                ("system", """You are an expert claims analyst. Compare the submitted claim report and estimated bill of repairs
+            self.embedding_model.warmup(self.warmup_queries)
+        except Exception as e:
+            logger.warning(f"Error warming up query embeddings: {str(e)}")
+
+    @cached_property
+    def risk_prompt(self) -> ChatPromptTemplate:
+        """Prompt comparing the claim report against the terms and conditions"""
+        return ChatPromptTemplate.from_messages([
+            ("system", """You are an expert claims analyst. Compare the submitted claim report and estimated bill of repairs
                 against the relevant terms and conditions to assess risk and validity.
                 
                 Important Note: The submitted documents are standardized compilations of the originals. Treat them as accurate and authentic representations of the full original records.
@@ -99,15 +175,36 @@ class ClaimRiskPredictor:
                     "recommended_actions": ["<list of specific next steps>"],
                     "confidence_score": <float between 0-1>
                 }}"""),
-                ("human", "\nQuestion: {question}")
-            ])
-            
-            self.document_processor = DocumentProcessor()
-            self.retrieval_system = RetrievalSystem(self.embedding_model)
-            
-        except Exception as e:
-            logger.error(f"Error setting up components: {str(e)}")
-            raise
+            ("human", "\nQuestion: {question}")
+        ])
+
+    @cached_property
+    def document_processor(self) -> DocumentProcessor:
+        """PDF loader and chunker for terms and claim documents"""
+        return DocumentProcessor()
+
+    @cached_property
+    def retrieval_system(self) -> RetrievalSystem:
+        """Builder for the hybrid BM25 and vector retrievers"""
+        return RetrievalSystem(self.embedding_model)
+
+    @cached_property
+    def llm_cache(self) -> SemanticLLMCache:
+        """Semantic cache of previous risk analyses"""
+        return SemanticLLMCache(self.embedding_model)
+
+    @cached_property
+    def fingerprint(self) -> str:
+        """Digest of the model name and prompt text, changing whenever either would change results"""
+        payload = f"{self.model_name}\0{self.risk_prompt.pretty_repr()}"
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters for the embedding and LLM response caches"""
+        return {
+            "embeddings": self.embedding_model.stats(),
+            "llm_responses": self.llm_cache.stats()
+        }
 
     def separate_documents(self, documents: List[Any]) -> Dict[str, List[Any]]:
         """Separate documents into terms & conditions and claim reports"""
@@ -117,7 +214,15 @@ class ClaimRiskPredictor:
         }
         
         for doc in documents:
-            doc_type = doc.metadata.get('doc_type', '').lower()
+            doc_type = doc.metadata.get('doc_type', '')
+            # Retriever chunks carry the integer DocumentType, parsed pages a detected label
+            if doc_type == DocumentType.TERMS:
+                separated_docs["terms_and_conditions"].append(doc)
+                continue
+            if doc_type == DocumentType.CLAIM:
+                separated_docs["claim_reports"].append(doc)
+                continue
+            doc_type = str(doc_type).lower()
             if 'terms' in doc_type or 'conditions' in doc_type or 't&c' in doc_type:
                 separated_docs["terms_and_conditions"].append(doc)
             elif 'claim' in doc_type or 'report' in doc_type:
@@ -127,11 +232,44 @@ class ClaimRiskPredictor:
 
     def format_documents(self, docs: List[Any]) -> str:
         """Format documents with metadata and content"""
-        return "\n\n".join([
-            f"Section: {doc.metadata.get('section', 'Unknown')}\n"
-            f"Content: {doc.page_content}"
-            for doc in docs
-        ])
+        buffer = io.StringIO()
+        for i, doc in enumerate(docs):
+            if i:
+                buffer.write("\n\n")
+            buffer.write("Section: ")
+            buffer.write(str(doc.metadata.get('section', 'Unknown')))
+            buffer.write("\nContent: ")
+            buffer.write(doc.page_content)
+        return buffer.getvalue()
+
+    def select_context_documents(self, docs: List[Any]) -> List[Any]:
+        """Drop near-duplicate chunks and keep the rest within the prompt token budget"""
+        selected = []
+        fingerprints = []
+        used_tokens = 0
+        
+        for doc in docs:
+            fingerprint = simhash64(doc.page_content)
+            if any((fingerprint ^ kept).bit_count() < NEAR_DUPLICATE_BITS for kept in fingerprints):
+                continue
+            
+            tokens = len(doc.page_content) // 4
+            if used_tokens + tokens > MAX_CONTEXT_TOKENS:
+                if selected:
+                    break
+                # The best match is always kept, but cut to the budget: a document without
+                # sections is indexed as one chunk and can be far larger than the prompt allows
+                doc = Document(
+                    page_content=doc.page_content[:MAX_CONTEXT_TOKENS * 4],
+                    metadata=dict(doc.metadata)
+                )
+                tokens = MAX_CONTEXT_TOKENS
+            
+            selected.append(doc)
+            fingerprints.append(fingerprint)
+            used_tokens += tokens
+        
+        return selected
 
     def count_documents(self, file_paths: List[str]) -> int:
         """Count the number of document files"""
@@ -141,12 +279,95 @@ class ClaimRiskPredictor:
 
     def process_claim(self, terms_file: str, claim_file: str, query: str) -> Dict[str, Any]:
         """Process claims by comparing terms & conditions against claim reports"""
+        return self.run_sync(self._aprocess_claim(terms_file=terms_file, claim_file=claim_file, query=query))
+
+    def run_sync(self, coro):
+        """Run a coroutine on the shared event loop and block until it finishes"""
+        return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result()
+
+    async def run_shared(self, coro):
+        """Await a coroutine on the shared event loop from whichever loop the caller runs on"""
+        loop = get_event_loop()
+        if asyncio.get_running_loop() is loop:
+            return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+    def build_rag_chain(self, terms_context: str, claim_context: str):
+        """Build the prompt, LLM and JSON parser chain over already formatted context"""
+        return (
+            {
+                "terms_and_conditions": lambda x: terms_context,
+                "claim_report": lambda x: claim_context,
+                "question": RunnablePassthrough()
+            }
+            | self.risk_prompt
+            | self.llm
+            | OrjsonOutputParser()
+        )
+
+    def file_signature(self, file_path: str) -> Optional[Tuple[str, str]]:
+        """Identify a file by its name and a digest of its contents, so a re-upload under a new path still hits"""
         try:
-            # Get initial document counts
-            total_files = self.count_documents([terms_file]) + self.count_documents([claim_file])
-            
+            with open(file_path, "rb") as f:
+                digest = hashlib.file_digest(f, "blake2b").hexdigest()
+        except OSError:
+            return None
+        # The name is part of the key because it is carried into the retrieved chunks' metadata
+        return (os.path.basename(file_path), digest)
+
+    def get_cached_retriever(self, key: Tuple) -> Optional[Tuple[Any, Any, str]]:
+        """Return the cached (processed document, retriever, index key) for a file, if its indexes still exist"""
+        if key[1] is None:
+            return None
+        with self._retriever_cache_lock:
+            cached = self._retriever_cache.get(key)
+            if cached is None:
+                return None
+            self._retriever_cache.move_to_end(key)
+        # Every hit keeps the shared indexes from eviction; an evicted one means the retriever must be rebuilt
+        if self.retrieval_system.touch_index(cached[2]):
+            return cached
+        with self._retriever_cache_lock:
+            if self._retriever_cache.get(key) is cached:
+                del self._retriever_cache[key]
+        return None
+
+    async def get_retriever(self, key: Tuple, processed_doc: Any, cached: Optional[Tuple[Any, Any, str]]) -> Any:
+        """Return the cached retriever, or build one in a worker thread and cache it under the file's key"""
+        if cached is not None:
+            return cached[1]
+        retriever, index_key = await asyncio.to_thread(self.retrieval_system.build_retriever, processed_doc)
+        if key[1] is not None:
+            with self._retriever_cache_lock:
+                self._retriever_cache[key] = (processed_doc, retriever, index_key)
+                while len(self._retriever_cache) > RETRIEVER_CACHE_SIZE:
+                    self._retriever_cache.popitem(last=False)
+        return retriever
+
+    async def retrieve_context(self, terms_file: str, claim_file: str, query: str, total_files: int) -> Dict[str, Any]:
+        """Process both documents and retrieve the sections relevant to the query"""
+        # Hashing reads both files, so keep it off the event loop
+        terms_signature, claim_signature = await asyncio.gather(
+            asyncio.to_thread(self.file_signature, terms_file),
+            asyncio.to_thread(self.file_signature, claim_file)
+        )
+        terms_key = ("terms_and_conditions", terms_signature)
+        claim_key = ("claim_reports", claim_signature)
+        cached_tc = self.get_cached_retriever(terms_key)
+        cached_claim = self.get_cached_retriever(claim_key)
+        
+        if cached_tc and cached_claim:
+            # Both files were processed before, possibly from another upload, so skip processing entirely
+            separated_docs = {
+                "terms_and_conditions": cached_tc[0],
+                "claim_reports": cached_claim[0]
+            }
+            tc_retriever, claim_retriever = cached_tc[1], cached_claim[1]
+        else:
             # Process all documents
-            documents = self.document_processor.process_documents(terms_file=terms_file, claim_file=claim_file)
+            documents = await asyncio.to_thread(
+                self.document_processor.process_documents, terms_file=terms_file, claim_file=claim_file
+            )
             
             if not documents:
                 return {
@@ -169,58 +390,160 @@ class ClaimRiskPredictor:
                     }
                 }
             
-            # Set up retrieval for both document types
-            tc_retriever = self.retrieval_system.setup_retrievers(separated_docs["terms_and_conditions"])
-            claim_retriever = self.retrieval_system.setup_retrievers(separated_docs["claim_reports"])
-            
-            # Get relevant sections from both document types
-            relevant_tc = tc_retriever.get_relevant_documents(query)
-            relevant_claims = claim_retriever.get_relevant_documents(query)
-            
-            rag_chain = (
-                {
-                    "terms_and_conditions": lambda x: self.format_documents(relevant_tc),
-                    "claim_report": lambda x: self.format_documents(relevant_claims),
-                    "question": RunnablePassthrough()
-                }
-                | self.risk_prompt
-                | self.llm
-                | JsonOutputParser()
+            # Set up retrieval for both document types; index building embeds every chunk, so run both in threads
+            tc_retriever, claim_retriever = await asyncio.gather(
+                self.get_retriever(terms_key, separated_docs["terms_and_conditions"], cached_tc),
+                self.get_retriever(claim_key, separated_docs["claim_reports"], cached_claim)
             )
+        
+        # Get relevant sections from both document types
+        relevant_tc, relevant_claims = await asyncio.gather(
+            tc_retriever.aget_relevant_documents(query),
+            claim_retriever.aget_relevant_documents(query)
+        )
+        
+        # Overlapping splitter windows often retrieve near-identical chunks; don't pay for them twice
+        relevant_tc = self.select_context_documents(relevant_tc)
+        relevant_claims = self.select_context_documents(relevant_claims)
+        
+        terms_context = self.format_documents(relevant_tc)
+        claim_context = self.format_documents(relevant_claims)
+        
+        return {
+            "total_files": total_files,
+            "separated_docs": separated_docs,
+            "relevant_tc": relevant_tc,
+            "relevant_claims": relevant_claims,
+            "terms_context": terms_context,
+            "claim_context": claim_context,
+            "cache_context": f"{terms_context}\n\n{claim_context}"
+        }
+
+    def build_result(self, response: Dict[str, Any], context: Dict[str, Any]) -> Dict[str, Any]:
+        """Combine the LLM analysis with retrieval metadata"""
+        separated_docs = context["separated_docs"]
+        relevant_tc = context["relevant_tc"]
+        relevant_claims = context["relevant_claims"]
+        
+        # Count sections safely
+        tc_sections = 1 if separated_docs["terms_and_conditions"] else 0
+        claim_sections = 1 if separated_docs["claim_reports"] else 0
+        
+        return {
+            "analysis": response,
+            "metadata": {
+                "processed_files": context["total_files"],
+                "terms_and_conditions": {
+                    "total_sections": tc_sections,
+                    "relevant_sections": len(relevant_tc) if relevant_tc else 0
+                },
+                "claim_reports": {
+                    "total_documents": claim_sections,
+                    "relevant_sections": len(relevant_claims) if relevant_claims else 0
+                },
+                "top_referenced_sections": [
+                    {
+                        "file_name": doc.metadata.get('file_name', 'Unknown'),
+                        "section": doc.metadata.get('section', 'Unknown')
+                    }
+                    for doc in (relevant_tc + relevant_claims)[:5]
+                ]
+            }
+        }
+
+    def process_claims_batch(self, items: List[Dict[str, str]], max_concurrency: int = BATCH_CONCURRENCY) -> List[Dict[str, Any]]:
+        """Process many claims concurrently; each item has terms_file, claim_file and query keys"""
+        return self.run_sync(self._aprocess_claims_batch(items, max_concurrency))
+
+    async def aprocess_claims_batch(self, items: List[Dict[str, str]], max_concurrency: int = BATCH_CONCURRENCY) -> List[Dict[str, Any]]:
+        """Async variant of process_claims_batch; results are returned in input order"""
+        return await self.run_shared(self._aprocess_claims_batch(items, max_concurrency))
+
+    async def _aprocess_claims_batch(self, items: List[Dict[str, str]], max_concurrency: int) -> List[Dict[str, Any]]:
+        # Bound in-flight requests so the batch stays under the provider's rate limits;
+        # throttled calls are retried with backoff by the LLM client (max_retries)
+        semaphore = asyncio.Semaphore(max_concurrency)
+        
+        async def process_one(item: Dict[str, str]) -> Dict[str, Any]:
+            async with semaphore:
+                return await self._aprocess_claim(
+                    terms_file=item["terms_file"],
+                    claim_file=item["claim_file"],
+                    query=item["query"]
+                )
+        
+        return await asyncio.gather(*(process_one(item) for item in items))
+
+    async def aprocess_claim(self, terms_file: str, claim_file: str, query: str) -> Dict[str, Any]:
+        """Async variant of process_claim that retrieves from both document types concurrently"""
+        return await self.run_shared(self._aprocess_claim(terms_file, claim_file, query))
+
+    async def _aprocess_claim(self, terms_file: str, claim_file: str, query: str) -> Dict[str, Any]:
+        try:
+            # Get initial document counts
+            total_files = self.count_documents([terms_file]) + self.count_documents([claim_file])
             
-            response = rag_chain.invoke(query)
+            context = await self.retrieve_context(terms_file, claim_file, query, total_files)
+            if "error" in context:
+                return context
             
-            # Count sections safely
-            tc_sections = 1 if separated_docs["terms_and_conditions"] else 0
-            claim_sections = 1 if separated_docs["claim_reports"] else 0
+            # Reuse a previous analysis when a similar question was asked over the same context
+            response = self.llm_cache.lookup(query, context["cache_context"])
+            if response is None:
+                rag_chain = self.build_rag_chain(context["terms_context"], context["claim_context"])
+                response = await rag_chain.ainvoke(query)
+                self.llm_cache.insert(query, context["cache_context"], response)
             
+            return self.build_result(response, context)
+            
+        except Exception as e:
+            logger.error(f"Error processing claim: {str(e)}")
             return {
-                "analysis": response,
+                "error": str(e),
                 "metadata": {
-                    "processed_files": total_files,
-                    "terms_and_conditions": {
-                        "total_sections": tc_sections,
-                        "relevant_sections": len(relevant_tc) if relevant_tc else 0
-                    },
-                    "claim_reports": {
-                        "total_documents": claim_sections,
-                        "relevant_sections": len(relevant_claims) if relevant_claims else 0
-                    },
-                    "top_referenced_sections": [
-                        {
-                            "file_name": doc.metadata.get('file_name', 'Unknown'),
-                            "section": doc.metadata.get('section', 'Unknown')
-                        }
-                        for doc in (relevant_tc + relevant_claims)[:5]
-                    ]
+                    "processed_files": total_files if 'total_files' in locals() else 0
                 }
             }
+
+    async def astream_claim(self, terms_file: str, claim_file: str, query: str) -> AsyncIterator[Dict[str, Any]]:
+        """Stream partial analyses while the LLM generates, ending with the full process_claim result"""
+        # Each step of the stream is advanced on the shared event loop
+        stream = self._astream_claim(terms_file, claim_file, query)
+        try:
+            while True:
+                try:
+                    yield await self.run_shared(stream.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            await self.run_shared(stream.aclose())
+
+    async def _astream_claim(self, terms_file: str, claim_file: str, query: str) -> AsyncIterator[Dict[str, Any]]:
+        try:
+            total_files = self.count_documents([terms_file]) + self.count_documents([claim_file])
+            
+            context = await self.retrieve_context(terms_file, claim_file, query, total_files)
+            if "error" in context:
+                yield context
+                return
+            
+            response = self.llm_cache.lookup(query, context["cache_context"])
+            if response is None:
+                rag_chain = self.build_rag_chain(context["terms_context"], context["claim_context"])
+                # The JSON parser emits partial objects as tokens arrive
+                async for partial in rag_chain.astream(query):
+                    response = partial
+                    yield {"analysis": partial, "partial": True}
+                if response is not None:
+                    self.llm_cache.insert(query, context["cache_context"], response)
+            
+            yield self.build_result(response, context)
             
         except Exception as e:
-            logger.error(f"Error processing claim: {str(e)}")
-            return {
+            logger.error(f"Error streaming claim analysis: {str(e)}")
+            yield {
                 "error": str(e),
                 "metadata": {
                     "processed_files": total_files if 'total_files' in locals() else 0
                 }
-            }
\ No newline at end of file
+            }
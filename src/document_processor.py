@@ -1,136 +1,174 @@
-from langchain.document_loaders import PyMuPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.schema import Document
-from typing import List, Dict, Optional, Tuple, Any
-import pandas as pd
+from typing import List, Dict, Optional, Tuple, Iterator, Any
+import fitz
+import hashlib
+import itertools
 import os
 import re
 from utils.text_preprocessing import clean_text, detect_document_type
 from utils.logging import setup_logging
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import datetime
+from enum import IntEnum
 
 logger = setup_logging()
 
-class DocumentType:
-    TERMS = "terms_and_conditions"
-    CLAIM = "claim_report"
+# Fixed regex patterns with proper anchoring and flags. Whitespace is written as [ \t]
+# so a header never spans lines and the whole text can be scanned in one pass.
+SECTION_PATTERNS = [
+    # Basic numbered sections
+    r"^[ \t]*(?:Section|SECTION)[ \t]+\d+(?:\.\d+)*",
+    r"^[ \t]*\d+(?:\.\d+)*[ \t]+[A-Z]",
+    # Headers in ALL CAPS
+    r"^[ \t]*[A-Z][A-Z \t]{2,}(?:[ \t]*\(.*\))?:?[ \t\r]*$",
+    # Insurance specific sections
+    r"^[ \t]*(?:COVERAGE|EXCLUSIONS?|CONDITIONS?|DEFINITIONS?)[ \t]*:?[ \t\r]*$",
+    # Articles and chapters
+    r"^[ \t]*(?:Article|ARTICLE|Chapter|CHAPTER)[ \t]+\d+(?:\.\d+)*",
+    # Common document sections
+    r"^[ \t]*(?:PURPOSE|SCOPE|INTRODUCTION|BACKGROUND|SUMMARY|CONCLUSION)s*:?[ \t\r]*$",
+    # Appendices and exhibits
+    r"^[ \t]*(?:Appendix|APPENDIX|Exhibit|EXHIBIT)[ \t]+[A-Z\d]+"
+]
+# Every pattern starts with the same line-start prefix; matching it once before the
+# alternation saves re-running it for each branch at every line
+HEADER_PREFIX = r"^[ \t]*"
+HEADER_PATTERN = HEADER_PREFIX + "(?:" + "|".join(
+    pattern.removeprefix(HEADER_PREFIX) for pattern in SECTION_PATTERNS
+) + ")"
+# Compiled once at import and shared by every DocumentProcessor
+HEADER_RE = re.compile(HEADER_PATTERN, re.MULTILINE)
+
+# Target chunk length for documents with detected section structure
+STRUCTURED_CHUNK_SIZE = 1000
+
+class DocumentType(IntEnum):
+    TERMS = 0
+    CLAIM = 1
 
 @dataclass
 class ProcessedDocument:
     content: str
-    doc_type: str
+    doc_type: DocumentType
     metadata: Dict
     sections: List[str]
 
 class DocumentProcessor:
     def __init__(self):
-        # Fixed regex patterns with proper anchoring and flags
-        self.section_patterns = [
-            # Basic numbered sections
-            r"^\s*(?:Section|SECTION)\s+\d+(?:\.\d+)*",
-            r"^\s*\d+(?:\.\d+)*\s+[A-Z]",
-            # Headers in ALL CAPS
-            r"^\s*[A-Z][A-Z\s]{2,}(?:\s*\(.*\))?:?$",
-            # Insurance specific sections
-            r"^\s*(?:COVERAGE|EXCLUSIONS?|CONDITIONS?|DEFINITIONS?)\s*:?$",
-            # Articles and chapters
-            r"^\s*(?:Article|ARTICLE|Chapter|CHAPTER)\s+\d+(?:\.\d+)*",
-            # Common document sections
-            r"^\s*(?:PURPOSE|SCOPE|INTRODUCTION|BACKGROUND|SUMMARY|CONCLUSION)s*:?$",
-            # Appendices and exhibits
-            r"^\s*(?:Appendix|APPENDIX|Exhibit|EXHIBIT)\s+[A-Z\d]+"
-        ]
-        self.header_pattern = "|".join(self.section_patterns)
+        self.section_patterns = SECTION_PATTERNS
+        self.header_pattern = HEADER_PATTERN
+        self.header_re = HEADER_RE
+        # Bound matchers skip the attribute lookups in the per-page and per-chunk loops
+        self._match_header = HEADER_RE.match
+        self._iter_headers = HEADER_RE.finditer
+        self._find_headers = HEADER_RE.findall
+        # Only two splitter configurations exist, so build both up front instead of per page
+        self._structured_splitter = RecursiveCharacterTextSplitter(
+            separators=["\n\n", "\n", " "],
+            chunk_size=STRUCTURED_CHUNK_SIZE,
+            chunk_overlap=200,
+            length_function=len,
+            keep_separator=True,
+            add_start_index=True,
+            strip_whitespace=True
+        )
+        self._standard_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=500,
+            chunk_overlap=50,
+            length_function=len,
+            separators=["\n\n", "\n", ".", " "],
+            keep_separator=False
+        )
 
-    def detect_structure_type(self, text: str) -> str:
-        """Detect the type of document structure"""
-        header_matches = len(re.findall(self.header_pattern, text, re.MULTILINE))
+    def classify_structure(self, header_matches: int) -> str:
+        """Map the number of detected section headers to a structure type"""
         if header_matches > 5:
             return "structured"
         return "standard"
 
+    def detect_structure_type(self, text: str) -> str:
+        """Detect the type of document structure"""
+        return self.classify_structure(len(self._find_headers(text)))
+
     def create_text_splitter(self, structure_type: str) -> RecursiveCharacterTextSplitter:
-        """Create appropriate text splitter based on document structure"""
+        """Return the text splitter for a document structure, built once per processor"""
         if structure_type == "structured":
-            return RecursiveCharacterTextSplitter(
-                separators=["\n\n", "\n", " "],
-                chunk_size=1000,
-                chunk_overlap=200,
-                length_function=len,
-                keep_separator=True,
-                add_start_index=True,
-                strip_whitespace=True
-            )
-        else:
-            return RecursiveCharacterTextSplitter(
-                chunk_size=500,
-                chunk_overlap=50,
-                length_function=len,
-                separators=["\n\n", "\n", ".", " "],
-                keep_separator=False
-            )
+            return self._structured_splitter
+        return self._standard_splitter
+
+    def iter_sections(self, text: str) -> Iterator[Tuple[str, Optional[str]]]:
+        """Yield (section_text, header) pairs from a single scan of the header pattern"""
+        # Every match starts at the beginning of a header line, so the match offsets are
+        # the section boundaries; the newline preceding each following header is dropped
+        start, header = 0, None
+        for match in self._iter_headers(text):
+            if match.start() != 0:
+                yield text[start:match.start() - 1], header
+            start, header = match.start(), match.group().strip()
+        yield text[start:], header
 
     def split_by_sections(self, text: str) -> List[str]:
         """Split text by section headers while preserving the headers"""
-        sections = []
-        current_section = []
-        
-        for line in text.split('\n'):
-            if re.match(self.header_pattern, line.strip()):
-                if current_section:
-                    sections.append('\n'.join(current_section))
-                current_section = [line]
-            else:
-                current_section.append(line)
-        
-        if current_section:
-            sections.append('\n'.join(current_section))
-            
-        return sections
+        return [section for section, _ in self.iter_sections(text)]
+
+    def iter_page_texts(self, file_path: str) -> Iterator[str]:
+        """Stream the text of each PDF page, closing the file once all pages are read"""
+        with fitz.open(file_path) as pdf:
+            for page in pdf:
+                yield page.get_text("text")
 
-    def process_single_document(self, file_path: str) -> List[Document]:
+    def process_single_document(self, file_path: str, timestamp: Optional[str] = None) -> List[Document]:
         """Process a single document and return list of processed chunks"""
         if not os.path.exists(file_path):
             logger.warning(f"File not found: {file_path}")
             return []
         
         try:
-            loader = PyMuPDFLoader(file_path)
-            docs = loader.load()
+            pages = self.iter_page_texts(file_path)
+            first_page = next(pages, None)
             
-            if not docs:
+            if first_page is None:
                 logger.warning(f"No content extracted from: {file_path}")
                 return []
             
             processed_docs = []
             metadata = {
                 "file_name": os.path.basename(file_path),
-                "doc_type": detect_document_type(docs[0].page_content),
-                "timestamp": pd.Timestamp.now().isoformat(),
+                "doc_type": detect_document_type(first_page),
+                "timestamp": timestamp or datetime.now().isoformat(),
                 "preprocessed": True
             }
             
-            for doc in docs:
-                cleaned_content = clean_text(doc.page_content)
+            for page_text in itertools.chain([first_page], pages):
+                cleaned_content = clean_text(page_text)
                 if not cleaned_content:
                     continue
                 
-                structure_type = self.detect_structure_type(cleaned_content)
+                # One header scan drives both the structure decision and the section split
+                sections = list(self.iter_sections(cleaned_content))
+                header_matches = sum(1 for _, header in sections if header is not None)
+                structure_type = self.classify_structure(header_matches)
                 text_splitter = self.create_text_splitter(structure_type)
                 
                 if structure_type == "structured":
-                    sections = self.split_by_sections(cleaned_content)
-                    for section in sections:
-                        splits = text_splitter.split_text(section)
+                    for section, header in sections:
+                        # A section that already fits in one chunk comes back from the splitter
+                        # stripped and otherwise unchanged, so skip the separator cascade
+                        if len(section) <= STRUCTURED_CHUNK_SIZE:
+                            stripped = section.strip()
+                            splits = [stripped] if stripped else []
+                        else:
+                            splits = text_splitter.split_text(section)
                         for split in splits:
-                            split_metadata = metadata.copy()
-                            split_metadata.update({
+                            split_metadata = {
+                                **metadata,
                                 "structure_type": structure_type,
                                 "word_count": len(split.split()),
                                 "char_count": len(split),
-                                "section_header": re.match(self.header_pattern, split.strip(), re.MULTILINE)
-                            })
+                                "section_header": header
+                            }
                             processed_docs.append(Document(
                                 page_content=split,
                                 metadata=split_metadata
@@ -138,12 +176,12 @@ class DocumentProcessor:
                 else:
                     splits = text_splitter.split_text(cleaned_content)
                     for split in splits:
-                        split_metadata = metadata.copy()
-                        split_metadata.update({
+                        split_metadata = {
+                            **metadata,
                             "structure_type": structure_type,
                             "word_count": len(split.split()),
                             "char_count": len(split)
-                        })
+                        }
                         processed_docs.append(Document(
                             page_content=split,
                             metadata=split_metadata
@@ -157,45 +195,71 @@ class DocumentProcessor:
 
     def get_section_titles(self, docs: List[Document]) -> List[str]:
         """Extract section titles from processed documents"""
-        titles = []
+        titles = set()
+        match_header = self._match_header
         for doc in docs:
             content = doc.page_content.strip()
-            if re.match(self.header_pattern, content, re.MULTILINE):
-                titles.append(content.split('\n')[0])
-        return list(set(titles))
+            if match_header(content):
+                titles.add(content.split('\n', 1)[0])
+        return list(titles)
 
-    def process_documents(self, terms_file: str, claim_file: str) -> Tuple[ProcessedDocument, ProcessedDocument]:
-        """Process both terms and claims documents and return as ProcessedDocument objects"""
-        # Process terms and conditions
-        terms_docs = self.process_single_document(terms_file)
-        terms_content = "\n".join([doc.page_content for doc in terms_docs])
-        terms_sections = self.get_section_titles(terms_docs)
-        
-        terms = ProcessedDocument(
-            content=terms_content,
-            doc_type=DocumentType.TERMS,
+    def same_content(self, first_file: str, second_file: str) -> bool:
+        """Check whether two paths refer to the same file or to files with identical bytes"""
+        try:
+            if os.path.samefile(first_file, second_file):
+                return True
+            if os.path.getsize(first_file) != os.path.getsize(second_file):
+                return False
+            with open(first_file, "rb") as first, open(second_file, "rb") as second:
+                return (hashlib.file_digest(first, "blake2b").digest()
+                        == hashlib.file_digest(second, "blake2b").digest())
+        except OSError:
+            return False
+
+    def build_processed_document(self,
+                                 docs: List[Document],
+                                 file_path: str,
+                                 doc_type: DocumentType,
+                                 processed_at: str,
+                                 sections: Optional[List[str]] = None) -> ProcessedDocument:
+        """Assemble a ProcessedDocument from the chunks of one file"""
+        if sections is None:
+            sections = self.get_section_titles(docs)
+        return ProcessedDocument(
+            content="\n".join([doc.page_content for doc in docs]),
+            doc_type=doc_type,
             metadata={
-                "file_name": os.path.basename(terms_file),
-                "processed_at": datetime.now().isoformat(),
-                "section_count": len(terms_sections)
+                "file_name": os.path.basename(file_path),
+                "processed_at": processed_at,
+                "section_count": len(sections)
             },
-            sections=terms_sections
+            sections=sections
         )
+
+    def process_documents(self, terms_file: str, claim_file: str) -> Tuple[ProcessedDocument, ProcessedDocument]:
+        """Process both terms and claims documents and return as ProcessedDocument objects"""
+        # One timestamp for the whole batch instead of one per file
+        processed_at = datetime.now().isoformat()
         
-        # Process claim report
-        claim_docs = self.process_single_document(claim_file)
-        claim_content = "\n".join([doc.page_content for doc in claim_docs])
-        claim_sections = self.get_section_titles(claim_docs)
+        # The same PDF is often passed as both documents, so parse it only once
+        if self.same_content(terms_file, claim_file):
+            logger.info(f"Terms and claim files have identical content, processing once: {terms_file}")
+            docs = self.process_single_document(terms_file, processed_at)
+            sections = self.get_section_titles(docs)
+            terms = self.build_processed_document(docs, terms_file, DocumentType.TERMS, processed_at, sections)
+            claim = self.build_processed_document(docs, claim_file, DocumentType.CLAIM, processed_at, list(sections))
+            return terms, claim
         
-        claim = ProcessedDocument(
-            content=claim_content,
-            doc_type=DocumentType.CLAIM,
-            metadata={
-                "file_name": os.path.basename(claim_file),
-                "processed_at": datetime.now().isoformat(),
-                "section_count": len(claim_sections)
-            },
-            sections=claim_sections
-        )
+        # Load both files concurrently; unlike a process pool, threads leave no pool state to break
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            terms_docs, claim_docs = executor.map(
+                self.process_single_document, [terms_file, claim_file], [processed_at, processed_at]
+            )
+        
+        # Process terms and conditions
+        terms = self.build_processed_document(terms_docs, terms_file, DocumentType.TERMS, processed_at)
+        
+        # Process claim report
+        claim = self.build_processed_document(claim_docs, claim_file, DocumentType.CLAIM, processed_at)
         
-        return terms, claim
\ No newline at end of file
+        return terms, claim
@@ -0,0 +1,83 @@
+from langchain_core.embeddings import Embeddings
+from collections import OrderedDict
+from functools import lru_cache
+from typing import List, Dict, Tuple, Any
+from array import array
+import threading
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that memoizes query and document embeddings"""
+
+    def __init__(self, embeddings: Embeddings, maxsize: int = 1024, document_cache_size: int = 4096):
+        self.embeddings = embeddings
+        # Vectors are stored as tuples so cached entries can't be mutated by callers
+        self._embed_query = lru_cache(maxsize=maxsize)(self._embed_query_uncached)
+        # Document vectors use compact float32 arrays since chunks far outnumber queries
+        self._document_cache: "OrderedDict[str, array]" = OrderedDict()
+        self._document_cache_size = document_cache_size
+        self._document_lock = threading.Lock()
+        self._document_hits = 0
+        self._document_misses = 0
+
+    def _embed_query_uncached(self, text: str) -> Tuple[float, ...]:
+        return tuple(self.embeddings.embed_query(text))
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a query, serving repeated queries from the cache"""
+        return list(self._embed_query(text))
+
+    def warmup(self, queries: List[str]):
+        """Pre-embed known queries so their first real lookup is a cache hit"""
+        for query in queries:
+            self._embed_query(query)
+
+    def _store_batch(self, texts: List[str], vectors: List[List[float]]) -> Dict[str, array]:
+        """Record a batch of document embeddings, evicting the least recently used"""
+        batch = {text: array("f", vector) for text, vector in zip(texts, vectors)}
+        with self._document_lock:
+            self._document_cache.update(batch)
+            while len(self._document_cache) > self._document_cache_size:
+                self._document_cache.popitem(last=False)
+        return batch
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed document chunks in one batched call, skipping chunks already embedded"""
+        vectors = {}
+        with self._document_lock:
+            for text in texts:
+                if text in self._document_cache:
+                    self._document_cache.move_to_end(text)
+                    vectors[text] = self._document_cache[text]
+
+        # Deduplicate while preserving order so overlapping chunks are embedded once
+        missing = list(dict.fromkeys(text for text in texts if text not in vectors))
+        if missing:
+            vectors.update(self._store_batch(missing, self.embeddings.embed_documents(missing)))
+
+        with self._document_lock:
+            self._document_hits += len(texts) - len(missing)
+            self._document_misses += len(missing)
+
+        return [list(vectors[text]) for text in texts]
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters for the query and document caches"""
+        info = self._embed_query.cache_info()
+        query_lookups = info.hits + info.misses
+        document_lookups = self._document_hits + self._document_misses
+        return {
+            "query": {
+                "hits": info.hits,
+                "misses": info.misses,
+                "size": info.currsize,
+                "maxsize": info.maxsize,
+                "hit_rate": info.hits / query_lookups if query_lookups else 0.0
+            },
+            "documents": {
+                "hits": self._document_hits,
+                "misses": self._document_misses,
+                "size": len(self._document_cache),
+                "maxsize": self._document_cache_size,
+                "hit_rate": self._document_hits / document_lookups if document_lookups else 0.0
+            }
+        }
@@ -0,0 +1,20 @@
+from langchain_core.output_parsers import JsonOutputParser
+from langchain_core.outputs import Generation
+from typing import List, Any
+import orjson
+
+class OrjsonOutputParser(JsonOutputParser):
+    """JSON output parser that decodes complete LLM responses with orjson"""
+
+    def parse_result(self, result: List[Generation], *, partial: bool = False) -> Any:
+        """Parse the final response with orjson, falling back to the tolerant LangChain parser"""
+        if not partial:
+            text = result[0].text.strip()
+            # Responses are usually wrapped in a ```json fence
+            if text.startswith("```"):
+                text = text.split("\n", 1)[-1].rsplit("```", 1)[0]
+            try:
+                return orjson.loads(text)
+            except orjson.JSONDecodeError:
+                pass
+        return super().parse_result(result, partial=partial)
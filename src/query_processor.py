@@ -0,0 +1,90 @@
+from typing import List, Dict, Tuple, Any, Optional, Set
+from utils.logging import setup_logging
+import asyncio
+import os
+
+logger = setup_logging()
+
+# Largest number of queued analyses dispatched to the predictor together
+MAX_BATCH = int(os.getenv("MAX_BATCH", "8"))
+# How long the first queued analysis waits for others to join its batch
+MAX_WAIT_MS = float(os.getenv("MAX_WAIT_MS", "75"))
+
+class QueryProcessor:
+    """Queue claim analyses from concurrent users and dispatch them to the predictor in batches"""
+
+    def __init__(self, predictor, max_batch: int = MAX_BATCH, max_wait_ms: float = MAX_WAIT_MS):
+        self.predictor = predictor
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        # The queue and dispatcher are bound to the event loop of the first submit
+        self._queue: Optional[asyncio.Queue] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._batches: Set[asyncio.Task] = set()
+
+    def _ensure_started(self):
+        if self._dispatcher is None or self._dispatcher.done():
+            self._queue = asyncio.Queue()
+            self._dispatcher = asyncio.create_task(self._dispatch_loop())
+
+    async def submit(self,
+                     terms_file: str,
+                     claim_file: str,
+                     query: str,
+                     dedupe_key: Optional[str] = None) -> Dict[str, Any]:
+        """Queue one analysis and wait for the result of the batch it is dispatched in"""
+        # dedupe_key must identify the file contents and query; requests without one are never merged
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        item = {"terms_file": terms_file, "claim_file": claim_file, "query": query}
+        await self._queue.put((item, dedupe_key, future))
+        return await future
+
+    async def _collect_batch(self) -> List[Tuple[Dict[str, str], Optional[str], asyncio.Future]]:
+        """Wait for one queued analysis, then gather more until the batch is full or the window closes"""
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _dispatch_loop(self):
+        while True:
+            batch = await self._collect_batch()
+            # Run the batch in its own task so the next one can fill while it is in flight
+            task = asyncio.create_task(self._run_batch(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _run_batch(self, batch: List[Tuple[Dict[str, str], Optional[str], asyncio.Future]]):
+        # Requests with the same content key in the same window share one analysis;
+        # paths are never compared since different uploads can share a file name
+        waiters: Dict[Any, List[asyncio.Future]] = {}
+        items = []
+        keys = []
+        for item, dedupe_key, future in batch:
+            key = dedupe_key if dedupe_key is not None else future
+            if key not in waiters:
+                waiters[key] = []
+                items.append(item)
+                keys.append(key)
+            waiters[key].append(future)
+
+        logger.info(f"Dispatching batch of {len(batch)} analyses ({len(items)} distinct)")
+        try:
+            results = await self.predictor.aprocess_claims_batch(items)
+        except Exception as e:
+            logger.error(f"Error processing batch: {str(e)}")
+            results = [{"error": str(e), "metadata": {}}] * len(items)
+
+        for key, result in zip(keys, results):
+            for future in waiters[key]:
+                if not future.done():
+                    future.set_result(result)
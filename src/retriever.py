@@ -2,22 +2,133 @@ from langchain_community.retrievers import BM25Retriever
 from langchain.retrievers.ensemble import EnsembleRetriever
 from langchain_community.vectorstores import Chroma
 from langchain.schema import Document
-from typing import List, Union, Tuple, Dict
+from typing import List, Union, Tuple, Dict, Any
 from utils.logging import setup_logging
+from document_processor import DocumentType
+from collections import Counter, OrderedDict
 from dataclasses import dataclass
+import chromadb
+import functools
+import hashlib
+import pickle
+import re
+import shutil
+import threading
+import os
 
 logger = setup_logging()
 
+# One persistent Chroma client lives here, with a collection per distinct document content
+VECTORSTORE_CACHE_DIR = os.path.join(".", ".chroma_cache")
+# Pickled BM25 indexes, one file per content key
+BM25_CACHE_DIR = os.path.join(VECTORSTORE_CACHE_DIR, "bm25")
+COLLECTION_PREFIX = "claim-"
+# Number of indexes kept, in memory and on disk, across the whole process; least recently
+# used ones are deleted, and retrievers cached on them are rebuilt on their next use
+VECTORSTORE_CACHE_SIZE = 64
+# Per-key client directories written by earlier versions of the cache
+LEGACY_KEY_RE = re.compile(r"[0-9a-f]{32}")
+# Readable names for the integer doc_type stored in chunk metadata
+DOC_TYPE_NAMES = {int(doc_type): doc_type.name for doc_type in DocumentType}
+
 @dataclass
 class ProcessedDocument:
     content: str
-    doc_type: str
+    doc_type: DocumentType
     metadata: Dict
     sections: List[str]
 
+class IndexCache:
+    """Chroma client and cached indexes shared by every retrieval system in the process"""
+
+    def __init__(self):
+        self._client = None
+        # Re-entrant because loading the persisted keys can evict through the client
+        self._client_lock = threading.RLock()
+        # Content keys of every cached index on disk, least recently used first
+        self._index_keys: "OrderedDict[str, None]" = OrderedDict()
+        self.vectorstores: Dict[str, Chroma] = {}
+        self.bm25_indexes: Dict[str, Any] = {}
+        self.lock = threading.Lock()
+
+    @property
+    def client(self):
+        """Chroma client shared by every cached collection, opened on first use"""
+        with self._client_lock:
+            if self._client is None:
+                self._client = chromadb.PersistentClient(path=VECTORSTORE_CACHE_DIR)
+                self._load_persisted_keys(self._client)
+            return self._client
+
+    def _load_persisted_keys(self, client):
+        """Register indexes left on disk by earlier runs so they count toward the cache limit"""
+        os.makedirs(BM25_CACHE_DIR, exist_ok=True)
+        for entry in os.scandir(VECTORSTORE_CACHE_DIR):
+            # Earlier versions kept one client directory per key; drop those leftovers
+            if entry.is_dir() and LEGACY_KEY_RE.fullmatch(entry.name):
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+        bm25_mtimes = {
+            entry.name[:-len(".pkl")]: entry.stat().st_mtime
+            for entry in os.scandir(BM25_CACHE_DIR) if entry.name.endswith(".pkl")
+        }
+        keys = set(bm25_mtimes)
+        for collection in client.list_collections():
+            name = getattr(collection, "name", collection)
+            if name.startswith(COLLECTION_PREFIX):
+                keys.add(name[len(COLLECTION_PREFIX):])
+
+        # Oldest first, so the least recently built indexes are evicted first
+        for key in sorted(keys, key=lambda key: bm25_mtimes.get(key, 0)):
+            self.touch(key)
+
+    def touch(self, key: str):
+        """Mark an index as most recently used, dropping the oldest beyond the cache limit"""
+        with self.lock:
+            self._index_keys[key] = None
+            self._index_keys.move_to_end(key)
+            evicted = []
+            while len(self._index_keys) > VECTORSTORE_CACHE_SIZE:
+                evicted.append(self._index_keys.popitem(last=False)[0])
+        for old_key in evicted:
+            self.drop(old_key)
+
+    def refresh(self, key: str) -> bool:
+        """Mark a cached index as most recently used, or report that it has been evicted"""
+        # Opening the client first registers the indexes persisted by earlier runs
+        self.client
+        with self.lock:
+            if key not in self._index_keys:
+                return False
+            self._index_keys.move_to_end(key)
+            return True
+
+    def drop(self, key: str):
+        """Delete an index from memory and disk so no document text outlives the cache"""
+        with self.lock:
+            self.vectorstores.pop(key, None)
+            self.bm25_indexes.pop(key, None)
+        try:
+            self.client.delete_collection(f"{COLLECTION_PREFIX}{key}")
+        except Exception:
+            pass
+        try:
+            os.remove(os.path.join(BM25_CACHE_DIR, f"{key}.pkl"))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Could not remove BM25 index {key}: {str(e)}")
+        logger.info(f"Evicted cached indexes {key}")
+
+@functools.cache
+def get_index_cache() -> IndexCache:
+    """Process-wide index cache, so no retrieval system deletes an index another one still uses"""
+    return IndexCache()
+
 class RetrievalSystem:
     def __init__(self, embedding_model):
         self.embedding_model = embedding_model
+        self.index_cache = get_index_cache()
 
     def _convert_to_documents(self, processed_doc: ProcessedDocument) -> List[Document]:
         """Convert ProcessedDocument to list of LangChain Documents"""
@@ -30,7 +141,7 @@ class RetrievalSystem:
             chunk_metadata = {
                 **processed_doc.metadata,  # Include original metadata
                 "chunk_index": i,
-                "doc_type": processed_doc.doc_type,
+                "doc_type": int(processed_doc.doc_type),
                 "total_chunks": len(chunks)
             }
             
@@ -57,30 +168,110 @@ class RetrievalSystem:
             
         return all_documents
 
+    def _content_key(self, documents: List[Document]) -> str:
+        """Hash the chunk contents, document type and source file of a document"""
+        digest = hashlib.blake2b(digest_size=16)
+        first = documents[0].metadata
+        digest.update(f"{first.get('doc_type')}\0{first.get('file_name')}\0".encode("utf-8"))
+        for doc in documents:
+            digest.update(doc.page_content.encode("utf-8", "surrogatepass"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def touch_index(self, key: str) -> bool:
+        """Keep a built index from eviction; False once it has been evicted and must be rebuilt"""
+        return self.index_cache.refresh(key)
+
+    def get_vectorstore(self, documents: List[Document], key: str) -> Chroma:
+        """Return a vector store for the documents, embedding them only if no store exists yet"""
+        with self.index_cache.lock:
+            vectorstore = self.index_cache.vectorstores.get(key)
+
+        if vectorstore is None:
+            # Each distinct content gets its own collection in the shared client, so a store
+            # built by an earlier request or process is reused without re-embedding any chunk
+            vectorstore = Chroma(
+                client=self.index_cache.client,
+                collection_name=f"{COLLECTION_PREFIX}{key}",
+                embedding_function=self.embedding_model
+            )
+            if not vectorstore.get(limit=1, include=[])["ids"]:
+                # Embed the whole corpus in one call and write the vectors directly, with ids
+                # derived from the key so a concurrent build of the same content is idempotent
+                texts = [doc.page_content for doc in documents]
+                vectorstore._collection.upsert(
+                    ids=[f"{key}-{i}" for i in range(len(texts))],
+                    embeddings=self.embedding_model.embed_documents(texts),
+                    documents=texts,
+                    metadatas=[doc.metadata for doc in documents]
+                )
+            else:
+                logger.info(f"Reusing persisted vector store {key}")
+            with self.index_cache.lock:
+                self.index_cache.vectorstores[key] = vectorstore
+
+        self.index_cache.touch(key)
+        return vectorstore
+
+    def get_bm25_retriever(self, documents: List[Document], key: str) -> BM25Retriever:
+        """Return a BM25 retriever for the documents, tokenizing the corpus only once per content"""
+        with self.index_cache.lock:
+            vectorizer = self.index_cache.bm25_indexes.get(key)
+
+        cache_path = os.path.join(BM25_CACHE_DIR, f"{key}.pkl")
+        if vectorizer is None and os.path.exists(cache_path):
+            try:
+                with open(cache_path, "rb") as f:
+                    vectorizer = pickle.load(f)
+                logger.info(f"Reusing persisted BM25 index {key}")
+            except Exception as e:
+                logger.warning(f"Ignoring unreadable BM25 cache {cache_path}: {str(e)}")
+
+        if vectorizer is None:
+            vectorizer = BM25Retriever.from_documents(documents, k=3).vectorizer
+            try:
+                os.makedirs(BM25_CACHE_DIR, exist_ok=True)
+                tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    pickle.dump(vectorizer, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, cache_path)
+            except OSError as e:
+                logger.warning(f"Could not persist BM25 index {key}: {str(e)}")
+
+        with self.index_cache.lock:
+            self.index_cache.bm25_indexes[key] = vectorizer
+        self.index_cache.touch(key)
+
+        # The index only depends on the chunk text, so it is paired with the current documents
+        return BM25Retriever(vectorizer=vectorizer, docs=documents, k=3)
+
     def setup_retrievers(self, 
                         documents: ProcessedDocument, 
                         ) -> EnsembleRetriever:
         """Set up multiple retrievers with BM25 and vector store"""
+        return self.build_retriever(documents)[0]
+
+    def build_retriever(self, documents: ProcessedDocument) -> Tuple[EnsembleRetriever, str]:
+        """Set up the ensemble retriever and return it with the content key of its indexes"""
         try:
             # Convert ProcessedDocuments to LangChain Documents
             # documents = self.prepare_documents(terms_doc, claim_doc)
+            doc_type = int(documents.doc_type)
             documents = self._convert_to_documents(documents)
             if not documents:
                 raise ValueError("No documents available for retriever setup")
 
+            # Both indexes are cached under the same content key
+            key = self._content_key(documents)
+
             # Initialize BM25 retriever
-            bm25_retriever = BM25Retriever.from_documents(
-                documents,
-                k=3
-            )
+            bm25_retriever = self.get_bm25_retriever(documents, key)
             
             # Initialize vector store retriever
-            vectorstore = Chroma.from_documents(
-                documents=documents,
-                embedding=self.embedding_model
-            )
+            vectorstore = self.get_vectorstore(documents, key)
+            # Restrict the dense search to this document type instead of scanning every vector
             vectorstore_retriever = vectorstore.as_retriever(
-                search_kwargs={"k": 2}
+                search_kwargs={"k": 2, "filter": {"doc_type": doc_type}}
             )
             
             # Combine retrievers
@@ -90,7 +281,7 @@ class RetrievalSystem:
             )
             
             logger.info(f"Successfully set up retrieval system with {len(documents)} documents")
-            return ensemble_retriever
+            return ensemble_retriever, key
             
         except Exception as e:
             logger.error(f"Error setting up retrievers: {str(e)}")
@@ -105,12 +296,11 @@ class RetrievalSystem:
             retrieved_docs = retriever.get_relevant_documents(query, k=k)
             
             # Log retrieval statistics
-            doc_types = {}
-            for doc in retrieved_docs:
-                doc_type = doc.metadata.get('doc_type', 'unknown')
-                doc_types[doc_type] = doc_types.get(doc_type, 0) + 1
+            doc_types = Counter(
+                DOC_TYPE_NAMES.get(doc.metadata.get('doc_type'), 'unknown') for doc in retrieved_docs
+            )
                 
-            logger.info(f"Retrieved {len(retrieved_docs)} documents: {doc_types}")
+            logger.info(f"Retrieved {len(retrieved_docs)} documents: {dict(doc_types)}")
             
             return retrieved_docs
             
@@ -0,0 +1,91 @@
+from langchain_core.embeddings import Embeddings
+from typing import List, Dict, Optional, Any
+from dataclasses import dataclass
+import numpy as np
+import hashlib
+import threading
+import time
+import copy
+
+@dataclass
+class CacheEntry:
+    context_key: str
+    vector: np.ndarray
+    response: Dict[str, Any]
+    created_at: float
+
+class SemanticLLMCache:
+    """Cache LLM responses for semantically similar queries over identical retrieved context"""
+
+    def __init__(self,
+                 embedding_model: Embeddings,
+                 threshold: float = 0.95,
+                 ttl_seconds: float = 3600,
+                 max_size: int = 512):
+        self.embedding_model = embedding_model
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self._entries: List[CacheEntry] = []
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @staticmethod
+    def _context_key(context: str) -> str:
+        """Hash the retrieved context so only answers over the same evidence are reused"""
+        return hashlib.sha256(context.encode("utf-8")).hexdigest()[:16]
+
+    def _embed(self, query: str) -> np.ndarray:
+        """Embed and L2-normalize a query so inner product equals cosine similarity"""
+        vector = np.asarray(self.embedding_model.embed_query(query), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _evict_expired(self, now: float):
+        self._entries = [e for e in self._entries if now - e.created_at <= self.ttl_seconds]
+
+    def lookup(self, query: str, context: str) -> Optional[Dict[str, Any]]:
+        """Return a cached response whose query is similar enough, or None on miss"""
+        context_key = self._context_key(context)
+        vector = self._embed(query)
+
+        with self._lock:
+            self._evict_expired(time.time())
+            candidates = [e for e in self._entries if e.context_key == context_key]
+            if candidates:
+                similarities = np.stack([e.vector for e in candidates]) @ vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    self._hits += 1
+                    return copy.deepcopy(candidates[best].response)
+            self._misses += 1
+            return None
+
+    def insert(self, query: str, context: str, response: Dict[str, Any]):
+        """Store a response for later similar queries over the same context"""
+        entry = CacheEntry(
+            context_key=self._context_key(context),
+            vector=self._embed(query),
+            response=copy.deepcopy(response),
+            created_at=time.time()
+        )
+
+        with self._lock:
+            self._evict_expired(entry.created_at)
+            self._entries.append(entry)
+            # Entries are kept in insertion order, so the oldest are dropped first
+            if len(self._entries) > self.max_size:
+                del self._entries[:len(self._entries) - self.max_size]
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters for monitoring the cache hit rate"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hit_rate": self._hits / lookups if lookups else 0.0
+            }
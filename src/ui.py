@@ -1,55 +1,208 @@
 import gradio as gr
+import asyncio
 import json
 from claim_risk_predictor import ClaimRiskPredictor
+from query_processor import QueryProcessor, MAX_BATCH
+from utils.logging import setup_logging
 import tempfile
+import hashlib
 import os
-import logging
-from typing import Dict, Any, Union
+import threading
+import time
+import queue
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Set, Tuple, Union
 
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+logger = setup_logging()
+
+COPY_BUFFER_SIZE = 1 << 20
+# Completed analyses kept for identical uploads and queries
+RESULT_CACHE_SIZE = 256
+RESULT_CACHE_TTL = 3600
+# Seconds a request waits for the predictor to finish loading
+MODEL_READY_TIMEOUT = 60
+# Pending requests Gradio queues before rejecting new ones
+QUEUE_MAX_SIZE = 64
 
 class ClaimRiskUI:
     def __init__(self):
-        self.predictor = ClaimRiskPredictor()
+        # The predictor loads in the background so the UI can start serving immediately
+        self.predictor: Optional[ClaimRiskPredictor] = None
+        self.query_processor: Optional[QueryProcessor] = None
+        self._ready = threading.Event()
+        threading.Thread(target=self._warmup, daemon=True).start()
         self.temp_dir = tempfile.mkdtemp()
-        logger.info(f"Initialized temporary directory at {self.temp_dir}")
+        # Uploads are copied independently, so their disk I/O can overlap
+        io_workers = min(8, (os.cpu_count() or 1) * 2)
+        self._io_pool = ThreadPoolExecutor(max_workers=io_workers)
+        # Scratch buffers reused by every copy instead of allocating one per chunk read
+        self._buffer_pool: "queue.LifoQueue[bytearray]" = queue.LifoQueue()
+        for _ in range(io_workers * 2):
+            self._buffer_pool.put(bytearray(COPY_BUFFER_SIZE))
+        # Results keyed by upload contents, query and predictor fingerprint, oldest evicted first
+        self.result_cache: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._result_cache_lock = threading.Lock()
+        # Cleanups still running after their response was returned
+        self._cleanup_tasks: Set[asyncio.Task] = set()
+        # Submitted analyses whose request may already have been cancelled
+        self._analysis_tasks: Set[asyncio.Task] = set()
+        logger.info("Initialized temporary directory at %s", self.temp_dir)
+
+    def _warmup(self):
+        """Build the predictor and its components, then release requests waiting on it"""
+        try:
+            predictor = ClaimRiskPredictor()
+            # Concurrent clicks are queued and sent to the predictor in small batches
+            self.query_processor = QueryProcessor(predictor)
+            self.predictor = predictor
+            # Build the lazily created clients now so the first request doesn't pay for them
+            try:
+                predictor.llm
+                predictor.embedding_model
+                predictor.retrieval_system
+                predictor.document_processor
+                predictor.fingerprint
+                predictor.warmup()
+            except Exception as e:
+                logger.warning("Error warming up predictor: %s", e)
+            logger.info("Claim risk predictor is ready")
+        except Exception as e:
+            logger.error("Error initializing predictor: %s", e)
+        finally:
+            self._ready.set()
+
+    def is_pdf(self, file: Union[tempfile.SpooledTemporaryFile, str]) -> bool:
+        """Check the upload's name for a PDF extension without touching its contents"""
+        name = file if isinstance(file, str) else getattr(file, "name", "")
+        return str(name).lower().endswith(".pdf")
+
+    def copy_stream(self, src, dst):
+        """Copy a binary stream through a pooled scratch buffer"""
+        buffer = self._buffer_pool.get()
+        try:
+            view = memoryview(buffer)
+            while True:
+                n = src.readinto(buffer)
+                if not n:
+                    break
+                dst.write(view[:n])
+        finally:
+            self._buffer_pool.put(buffer)
+
+    def link_file(self, src_path: str, dst_path: str) -> bool:
+        """Hard link a file into place, returning False when it has to be copied instead"""
+        try:
+            os.link(src_path, dst_path)
+            return True
+        except OSError:
+            # EXDEV across filesystems, or links unsupported by the filesystem; an existing
+            # destination is never replaced since it may belong to another request
+            return False
 
     def save_uploaded_file(self, file: Union[tempfile.SpooledTemporaryFile, str]) -> str:
         """Save a single uploaded file and return its path"""
         if file is None:
             return None
             
+        temp_path = None
         try:
-            if isinstance(file, tempfile.SpooledTemporaryFile):
-                temp_path = os.path.join(self.temp_dir, file.name)
-                content = file.read()
-            elif isinstance(file, str):
-                temp_path = os.path.join(self.temp_dir, os.path.basename(file))
-                with open(file, 'rb') as f:
-                    content = f.read()
-            else:
+            if not isinstance(file, (tempfile.SpooledTemporaryFile, str)):
                 return None
 
-            with open(temp_path, 'wb') as f:
-                f.write(content)
+            # Every upload gets its own directory, so concurrent requests for files with the
+            # same name never share a path while the original name is kept for the analysis
+            name = os.path.basename(file if isinstance(file, str) else file.name)
+            temp_path = os.path.join(tempfile.mkdtemp(dir=self.temp_dir), name)
+
+            # Copy through a pooled 1 MiB buffer instead of reading whole PDFs into memory
+            if isinstance(file, tempfile.SpooledTemporaryFile):
+                file.seek(0)
+                with open(temp_path, 'xb') as dst:
+                    self.copy_stream(file, dst)
+            # Gradio's upload is already on disk, so link it in and only copy across filesystems
+            elif not self.link_file(file, temp_path):
+                with open(file, 'rb') as src, open(temp_path, 'xb') as dst:
+                    self.copy_stream(src, dst)
+
             return temp_path
             
         except Exception as e:
-            logger.error(f"Error saving file: {str(e)}")
+            logger.error("Error saving file: %s", e)
+            self.cleanup_files(temp_path)
             return None
 
+    def save_uploaded_files(self, *files: Union[tempfile.SpooledTemporaryFile, str]) -> List[str]:
+        """Save several uploaded files concurrently and return their paths in order"""
+        return list(self._io_pool.map(self.save_uploaded_file, files))
+
+    def result_key(self, terms_path: str, claim_path: str, query: str) -> str:
+        """Build a cache key from the file contents, the query and the predictor fingerprint"""
+        digest = hashlib.sha256()
+        for path in (terms_path, claim_path):
+            with open(path, "rb") as f:
+                digest.update(hashlib.file_digest(f, "sha256").digest())
+        digest.update(query.encode("utf-8"))
+        digest.update(self.predictor.fingerprint.encode("utf-8"))
+        return digest.hexdigest()
+
+    def get_cached_result(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a cached result that has not expired"""
+        with self._result_cache_lock:
+            entry = self.result_cache.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > RESULT_CACHE_TTL:
+                del self.result_cache[key]
+                return None
+            self.result_cache.move_to_end(key)
+            return entry[1]
+
+    def cache_result(self, key: str, result: Dict[str, Any]):
+        """Store a successful result, evicting the least recently used entries"""
+        if "error" in result:
+            return
+        with self._result_cache_lock:
+            self.result_cache[key] = (time.monotonic(), result)
+            self.result_cache.move_to_end(key)
+            while len(self.result_cache) > RESULT_CACHE_SIZE:
+                self.result_cache.popitem(last=False)
+
     def cleanup_files(self, *file_paths: str):
         """Clean up temporary files"""
         for path in file_paths:
-            if path and os.path.exists(path):
+            if not path:
+                continue
+            # Unlinking directly saves a stat per file; a missing file needs no cleanup
+            try:
+                os.unlink(path)
+                logger.info("Cleaned up file: %s", path)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.error("Error cleaning up file %s: %s", path, e)
+            # Remove the upload's own directory, never the shared temporary directory
+            upload_dir = os.path.dirname(path)
+            if os.path.dirname(upload_dir) == self.temp_dir:
                 try:
-                    os.remove(path)
-                    logger.info(f"Cleaned up file: {path}")
-                except Exception as e:
-                    logger.error(f"Error cleaning up file {path}: {str(e)}")
+                    os.rmdir(upload_dir)
+                except OSError as e:
+                    logger.error("Error cleaning up directory %s: %s", upload_dir, e)
+
+    def schedule_cleanup(self, *file_paths: str):
+        """Clean up temporary files in the background instead of delaying the response"""
+        task = asyncio.create_task(asyncio.to_thread(self.cleanup_files, *file_paths))
+        self._cleanup_tasks.add(task)
+        task.add_done_callback(self._cleanup_tasks.discard)
 
-    def process_documents(self, 
+    def _analysis_done(self, task: asyncio.Task, *file_paths: str):
+        self._analysis_tasks.discard(task)
+        # Retrieve the outcome so an analysis nobody awaits anymore does not log an unretrieved error
+        if not task.cancelled():
+            task.exception()
+        self.schedule_cleanup(*file_paths)
+
+    async def process_documents(self, 
                         terms_file: tempfile.SpooledTemporaryFile,
                         claim_file: tempfile.SpooledTemporaryFile, 
                         query: str) -> Dict[str, Any]:
@@ -67,33 +220,67 @@ class ClaimRiskUI:
                     "metadata": {}
                 }
 
-            # Save uploaded files
-            terms_path = self.save_uploaded_file(terms_file)
-            claim_path = self.save_uploaded_file(claim_file)
+            if not await asyncio.to_thread(self._ready.wait, MODEL_READY_TIMEOUT):
+                return {
+                    "error": "The analysis model is still loading, please retry shortly.",
+                    "metadata": {}
+                }
 
-            if not terms_path or not claim_path:
+            if self.predictor is None:
                 return {
-                    "error": "Error saving uploaded files.",
+                    "error": "The analysis model failed to load.",
                     "metadata": {}
                 }
 
-            logger.info(f"Processing terms file: {terms_path}")
-            logger.info(f"Processing claim file: {claim_path}")
+            # Reject other file types before copying anything to disk
+            if not self.is_pdf(terms_file) or not self.is_pdf(claim_file):
+                return {
+                    "error": "Only PDF documents are supported.",
+                    "metadata": {}
+                }
 
-            # Process the claim
-            result = self.predictor.process_claim(
-                terms_file=terms_path,
-                claim_file=claim_path,
-                query=query
-            )
+            # Save uploaded files off the event loop so other requests keep being served
+            terms_path, claim_path = await asyncio.to_thread(self.save_uploaded_files, terms_file, claim_file)
 
-            # Cleanup temporary files
-            self.cleanup_files(terms_path, claim_path)
+            analysis = None
+            try:
+                if not terms_path or not claim_path:
+                    return {
+                        "error": "Error saving uploaded files.",
+                        "metadata": {}
+                    }
 
-            return result
+                logger.info("Processing terms file: %s", terms_path)
+                logger.info("Processing claim file: %s", claim_path)
+
+                # Identical uploads and query are answered without running the pipeline again
+                key = await asyncio.to_thread(self.result_key, terms_path, claim_path, query)
+                result = self.get_cached_result(key)
+                if result is not None:
+                    logger.info("Returning cached analysis result")
+                else:
+                    # Process the claim; identical requests in the same batch run on this request's
+                    # files, so they are kept until the analysis finishes even if this request is cancelled
+                    analysis = asyncio.create_task(self.query_processor.submit(
+                        terms_file=terms_path,
+                        claim_file=claim_path,
+                        query=query,
+                        dedupe_key=key
+                    ))
+                    self._analysis_tasks.add(analysis)
+                    analysis.add_done_callback(lambda task: self._analysis_done(task, terms_path, claim_path))
+                    result = await asyncio.shield(analysis)
+                    self.cache_result(key, result)
+
+                return result
+
+            finally:
+                # A submitted analysis removes its files when it finishes
+                if analysis is None:
+                    self.schedule_cleanup(terms_path, claim_path)
 
         except Exception as e:
-            logger.error(f"Error processing documents: {str(e)}")
+            logger.error("Error processing documents: %s", e)
             return {
                 "error": f"Error processing documents: {str(e)}",
                 "metadata": {}
@@ -197,12 +384,16 @@ class ClaimRiskUI:
                         lines=20
                     )
 
+            async def analyze(terms, claim, query):
+                return self.format_output(await self.process_documents(terms, claim, query))
+
+            # Let as many analyses run at once as the batching queue can combine into one batch
             analyze_button.click(
-                fn=lambda terms, claim, query: self.format_output(
-                    self.process_documents(terms, claim, query)
-                ),
+                fn=analyze,
                 inputs=[terms_file, claim_file, query_input],
-                outputs=output_text
+                outputs=output_text,
+                concurrency_id="predict",
+                concurrency_limit=MAX_BATCH
             )
 
             gr.Markdown("""
@@ -224,7 +415,7 @@ class ClaimRiskUI:
 def main():
     ui = ClaimRiskUI()
     interface = ui.create_ui()
-    interface.launch(
+    interface.queue(max_size=QUEUE_MAX_SIZE, default_concurrency_limit=MAX_BATCH).launch(
         server_name="0.0.0.0",
         server_port=7860,
         share=True,
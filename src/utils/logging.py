@@ -2,5 +2,12 @@ import logging
 
 def setup_logging():
     """Configure logging for the application"""
-    logging.basicConfig(level=logging.INFO)
-    return logging.getLogger(__name__)
+    logger = logging.getLogger("claim")
+    # Every module shares this logger, so its handler is only attached on the first call
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    return logger
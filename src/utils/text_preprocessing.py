@@ -1,26 +1,130 @@
+from collections import OrderedDict
+import numpy as np
+import functools
+import hashlib
+import threading
 
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# Punctuation kept by clean_text alongside alphanumeric characters
+CLEAN_TEXT_PUNCTUATION = '. ,?!-()[]{}:;'
+
+class _CleanTextTable(dict):
+    """str.translate table that keeps allowed characters and deletes the rest, filled in lazily"""
+
+    def __missing__(self, codepoint: int):
+        char = chr(codepoint)
+        value = codepoint if char.isalnum() or char in CLEAN_TEXT_PUNCTUATION else None
+        self[codepoint] = value
+        return value
+
+_CLEAN_TEXT_TABLE = _CleanTextTable()
+
+# Keywords counted by detect_document_type; ties go to the earlier document type
+DOCUMENT_TYPE_KEYWORDS = {
+    "claim_report": ["claim", "incident", "accident", "damage", "loss"],
+    "policy_document": ["policy", "terms", "conditions", "coverage", "insurance"],
+    "medical_report": ["diagnosis", "treatment", "medical", "physician", "patient"],
+    "invoice": ["invoice", "bill", "payment", "amount", "due"],
+    "correspondence": ["letter", "email", "correspondence", "regarding", "dear"]
+}
+
+def _build_keyword_automaton():
+    """Build an Aho-Corasick automaton over every document type keyword"""
+    automaton = ahocorasick.Automaton()
+    for type_index, keywords in enumerate(DOCUMENT_TYPE_KEYWORDS.values()):
+        for keyword in keywords:
+            automaton.add_word(keyword, (type_index, keyword))
+    automaton.make_automaton()
+    return automaton
+
+# pyahocorasick is optional; without it keywords are searched one at a time
+_KEYWORD_AUTOMATON = _build_keyword_automaton() if ahocorasick is not None else None
+_KEYWORD_TOTAL = sum(len(keywords) for keywords in DOCUMENT_TYPE_KEYWORDS.values())
+_DOCUMENT_TYPES = list(DOCUMENT_TYPE_KEYWORDS)
+
+def content_digest(data: bytes) -> bytes:
+    """Return a 128-bit digest of the text bytes, using xxhash when it is installed"""
+    if xxhash is not None:
+        return xxhash.xxh3_128_digest(data)
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+def cache_by_content(maxsize: int = 4096):
+    """Memoize a text-keyed function on a compact digest of the text instead of the text itself"""
+    def decorator(func):
+        cache = OrderedDict()
+        lock = threading.Lock()
+
+        @functools.wraps(func)
+        def wrapper(text: str):
+            if not text:
+                return func(text)
+            key = content_digest(text.encode("utf-8", "surrogatepass"))
+            with lock:
+                if key in cache:
+                    cache.move_to_end(key)
+                    return cache[key]
+            value = func(text)
+            with lock:
+                cache[key] = value
+                if len(cache) > maxsize:
+                    cache.popitem(last=False)
+            return value
+
+        wrapper.cache_clear = cache.clear
+        return wrapper
+    return decorator
+
+@cache_by_content()
 def clean_text(text: str) -> str:
     """Clean and normalize text content"""
     if not text:
         return ""
     text = " ".join(text.split())
-    text = ''.join(char for char in text if char.isalnum() or char in '. ,?!-()[]{}:;')
-    return text
+    # Filtering after the whitespace collapse keeps the original output, including the
+    # double spaces left where a removed character stood between two words
+    return text.translate(_CLEAN_TEXT_TABLE)
 
+@cache_by_content()
 def detect_document_type(content: str) -> str:
     """Detect document type based on content keywords"""
     content = content.lower()
     
-    patterns = {
-        "claim_report": ["claim", "incident", "accident", "damage", "loss"],
-        "policy_document": ["policy", "terms", "conditions", "coverage", "insurance"],
-        "medical_report": ["diagnosis", "treatment", "medical", "physician", "patient"],
-        "invoice": ["invoice", "bill", "payment", "amount", "due"],
-        "correspondence": ["letter", "email", "correspondence", "regarding", "dear"]
-    }
-    
-    matches = {doc_type: sum(1 for keyword in keywords if keyword in content)
-              for doc_type, keywords in patterns.items()}
+    counts = np.zeros(len(_DOCUMENT_TYPES), dtype=np.int32)
+    if _KEYWORD_AUTOMATON is not None:
+        # One pass over the text finds every keyword; each one counts once however often it occurs
+        found = set()
+        for _, (type_index, keyword) in _KEYWORD_AUTOMATON.iter(content):
+            if keyword not in found:
+                found.add(keyword)
+                counts[type_index] += 1
+                if len(found) == _KEYWORD_TOTAL:
+                    break
+    else:
+        for type_index, keywords in enumerate(DOCUMENT_TYPE_KEYWORDS.values()):
+            counts[type_index] = sum(1 for keyword in keywords if keyword in content)
     
-    max_matches = max(matches.values()) if matches else 0
-    return "other" if max_matches == 0 else max(matches.items(), key=lambda x: x[1])[0]
\ No newline at end of file
+    # argmax returns the first of tied types, matching the keyword table's order
+    best = int(counts.argmax())
+    return "other" if counts[best] == 0 else _DOCUMENT_TYPES[best]
+
+def simhash64(text: str, ngram: int = 3) -> int:
+    """Compute a 64-bit SimHash fingerprint of the text's word n-grams"""
+    words = text.lower().split()
+    shingles = [" ".join(words[i:i + ngram]) for i in range(max(len(words) - ngram + 1, 1))]
+    digests = b"".join(
+        hashlib.blake2b(shingle.encode("utf-8", "surrogatepass"), digest_size=8).digest()
+        for shingle in shingles
+    )
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8).reshape(-1, 8), axis=1)
+    # Each bit of the fingerprint is set when most shingle hashes have it set
+    majority = bits.sum(axis=0) * 2 > len(shingles)
+    return int.from_bytes(np.packbits(majority).tobytes(), "big")
\ No newline at end of file